@@ -299,22 +299,23 @@ def generate_css_selector(element):
         try:
             xpath = element.parent.execute_script("""
                 function getXPath(element) {
-                    if (element.id !== '') {
-                        return "//*[@id='" + element.id + "']";
-                    }
-                    if (element === document.body) {
-                        return '/html/body';
-                    }
-                    var ix = 0;
-                    var siblings = element.parentNode.childNodes;
-                    for (var i = 0; i < siblings.length; i++) {
-                        var sibling = siblings[i];
-                        if (sibling === element) {
-                            return getXPath(element.parentNode) + '/' + element.tagName.toLowerCase() + '[' + (ix + 1) + ']';
+                    var path = '';
+                    while (element) {
+                        if (element.id !== '') {
+                            return "//*[@id='" + element.id + "']" + path;
+                        }
+                        if (element === document.body) {
+                            return '/html/body' + path;
                         }
-                        if (sibling.nodeType === 1 && sibling.tagName === element.tagName) {
-                            ix++;
+                        // Count same-tag element siblings before this one only
+                        var ix = 1;
+                        for (var sibling = element.previousElementSibling; sibling; sibling = sibling.previousElementSibling) {
+                            if (sibling.tagName === element.tagName) {
+                                ix++;
+                            }
                         }
+                        path = '/' + element.tagName.toLowerCase() + '[' + ix + ']' + path;
+                        element = element.parentNode;
                     }
                 }
                 return getXPath(arguments[0]);
@@ -0,0 +1,138 @@
+import itertools
+import threading
+from urllib.request import urlopen
+
+# websocket-client is installed alongside selenium
+import websocket
+# Tab snapshots come back as multi-megabyte JSON frames; orjson decodes them several times faster than json
+import orjson
+
+
+class CDPError(Exception):
+    pass
+
+
+# Get the host:port of the DevTools endpoint chromedriver attached to
+def get_debugger_address(browser):
+    chrome_options = browser.capabilities.get("goog:chromeOptions", {})
+    return chrome_options.get("debuggerAddress")
+
+# List open tabs straight from Chrome's DevTools HTTP endpoint
+def list_page_targets(debugger_address, timeout=2):
+    """Return the page targets, most recently focused tab first"""
+    with urlopen(f"http://{debugger_address}/json/list", timeout=timeout) as response:
+        targets = orjson.loads(response.read())
+    return [target for target in targets
+            if target.get("type") == "page" and target.get("webSocketDebuggerUrl")]
+
+
+class CDPSession:
+    """Direct DevTools websocket connection to a single tab.
+
+    Each tab gets its own socket, so commands for different tabs can run
+    concurrently without going through chromedriver or switching windows.
+    """
+
+    def __init__(self, target_id, ws_url, timeout=5):
+        self.target_id = target_id
+        self.timeout = timeout
+        self.closed = False
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._listeners = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+
+        # No Origin header, so Chrome accepts the connection without --remote-allow-origins
+        self._ws = websocket.create_connection(ws_url, timeout=timeout, suppress_origin=True)
+        self._ws.settimeout(None)
+
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def send(self, method, params=None):
+        """Send a command and block until its result arrives"""
+        if self.closed:
+            raise CDPError(f"Session for {self.target_id} is closed")
+
+        message_id = next(self._ids)
+        waiter = {"event": threading.Event(), "response": None}
+        with self._lock:
+            self._pending[message_id] = waiter
+
+        try:
+            self._write(message_id, method, params)
+            if not waiter["event"].wait(self.timeout):
+                raise CDPError(f"Timed out waiting for {method}")
+        finally:
+            with self._lock:
+                self._pending.pop(message_id, None)
+
+        response = waiter["response"]
+        if response is None:
+            raise CDPError(f"Session for {self.target_id} closed during {method}")
+        if "error" in response:
+            raise CDPError(response["error"].get("message", str(response["error"])))
+        return response.get("result", {})
+
+    def post(self, method, params=None):
+        """Send a command without waiting for the result (safe inside event callbacks)"""
+        if not self.closed:
+            self._write(next(self._ids), method, params)
+
+    def on(self, event, callback):
+        """Register a callback for a CDP event; it runs on the reader thread"""
+        self._listeners.setdefault(event, []).append(callback)
+
+    def evaluate(self, expression):
+        """Evaluate a JS expression in the tab and return its JSON value"""
+        result = self.send("Runtime.evaluate", {
+            "expression": expression,
+            "returnByValue": True,
+            "awaitPromise": False
+        })
+        if "exceptionDetails" in result:
+            raise CDPError(result["exceptionDetails"].get("text", "Evaluation failed"))
+        return result.get("result", {}).get("value")
+
+    def close(self):
+        self.closed = True
+        try:
+            self._ws.close()
+        except Exception:
+            pass
+
+    def _write(self, message_id, method, params):
+        payload = orjson.dumps({"id": message_id, "method": method, "params": params or {}})
+        with self._send_lock:
+            # Bytes go out as-is in a text frame, no re-encoding
+            self._ws.send(payload)
+
+    def _read_loop(self):
+        while not self.closed:
+            try:
+                message = orjson.loads(self._ws.recv())
+            except Exception:
+                # Socket closed: tab was closed or browser went away
+                break
+
+            if "id" in message:
+                with self._lock:
+                    waiter = self._pending.get(message["id"])
+                if waiter:
+                    waiter["response"] = message
+                    waiter["event"].set()
+                continue
+
+            for callback in self._listeners.get(message.get("method"), []):
+                try:
+                    callback(message.get("params", {}))
+                except Exception as e:
+                    print(f"Error in CDP listener for {message.get('method')}: {e}")
+
+        self.closed = True
+        # Wake anyone still waiting on a response
+        with self._lock:
+            waiters = list(self._pending.values())
+        for waiter in waiters:
+            waiter["event"].set()
@@ -1,49 +1,108 @@
 import time
 import threading
+import queue
 import os
 import platform
-import subprocess
+import shutil
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, NavigableString, Tag
+import xxhash
 
+from browser.cdp import CDPSession, get_debugger_address, list_page_targets
 from database.graph_db import store_in_neo4j
-from database.vector_db import store_in_pgvector
+from database.vector_db import store_in_pgvector, flush_pending_embeddings, prepare_bulk_load, finalize_bulk_load
 from util.signals import signals
 
 # Global variables
 browser = None
 capture_thread = None
+finish_thread = None
+# Cleared while a stopped capture's pending writes are still being stored
+capture_flushed = threading.Event()
+capture_flushed.set()
 stop_capturing = False
 flows = {}
 TARGET_WEBSITE = ""
 all_windows = set()
+debugger_address = None
+cdp_sessions = {}
+last_sig_by_target = {}
+dirty_targets = set()
+# Set whenever a tab reports a change, so the capture loop sleeps until there is work
+capture_event = threading.Event()
+# Longest the capture loop sleeps without an event; newly opened tabs have no
+# session to report through yet, so they are picked up on this timeout
+CAPTURE_IDLE_TIMEOUT = 1.0
+# Shortest time between the starts of two capture passes, so a page that never
+# stops mutating (carousel, clock, spinner) is snapshotted at a bounded rate
+CAPTURE_MIN_INTERVAL = 0.5
+capture_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tab-capture")
+
+# Parsed metadata of recently seen pages, keyed by content hash
+metadata_cache = OrderedDict()
+METADATA_CACHE_SIZE = 64
+
+# Captured pages are persisted off the capture thread by a background writer
+write_queue = queue.Queue(maxsize=10000)
+write_lock = threading.Lock()
+db_writer_thread = None
+
+# Last known browser state; kept fresh by probe_browser so callers never wait on I/O
+browser_alive = False
+ALIVE_PROBE_INTERVAL = 5
+liveness_thread = None
 
 # Check if browser is still alive
 def is_browser_alive():
-    global browser
+    return browser is not None and browser_alive
+
+# Actively check that the browser responds and update the cached state
+def probe_browser():
+    global browser_alive
     try:
         if browser is None:
-            return False
-        # A simple operation to check if browser is responsive
-        browser.current_window_handle
-        return True
+            browser_alive = False
+        else:
+            # A simple operation to check if browser is responsive
+            browser.current_window_handle
+            browser_alive = True
     except:
-        return False
+        browser_alive = False
+    return browser_alive
+
+# Background probe so a closed browser is noticed even when nothing else fails
+def liveness_monitor():
+    while True:
+        time.sleep(ALIVE_PROBE_INTERVAL)
+        if browser is not None:
+            probe_browser()
+
+# Start the liveness monitor once
+def start_liveness_monitor():
+    global liveness_thread
+    if liveness_thread is None or not liveness_thread.is_alive():
+        liveness_thread = threading.Thread(target=liveness_monitor, daemon=True)
+        liveness_thread.start()
 
-# Find Chrome installation
+# Platform is fixed for the life of the process
+SYSTEM = platform.system()
+
+# Find Chrome installation (the result can't change while the app runs, so it is looked up once)
+@functools.cache
 def find_chrome_executable():
     # Default locations for Chrome executable by platform
-    if platform.system() == "Windows":
+    if SYSTEM == "Windows":
         paths = [
             r"C:\Program Files\Google\Chrome\Application\chrome.exe",
             r"C:\Program Files (x86)\Google\Chrome\Application\chrome.exe",
             os.path.expanduser(r"~\AppData\Local\Google\Chrome\Application\chrome.exe"),
         ]
-    elif platform.system() == "Darwin":  # macOS
+    elif SYSTEM == "Darwin":  # macOS
         paths = [
             "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome",
             "/Applications/Chrome.app/Contents/MacOS/Chrome",
@@ -62,30 +121,23 @@ def find_chrome_executable():
         if os.path.exists(path) and os.access(path, os.X_OK):
             return path
     
-    # If not found in default locations, try to find using 'which' (Unix-like systems)
-    if platform.system() != "Windows":
-        try:
-            chrome_path = subprocess.check_output(["which", "google-chrome"], text=True).strip()
-            if chrome_path:
-                return chrome_path
-        except:
-            pass
-        
-        try:
-            chrome_path = subprocess.check_output(["which", "chromium"], text=True).strip()
-            if chrome_path:
-                return chrome_path
-        except:
-            pass
+    # If not found in default locations, search PATH in-process (Unix-like systems)
+    if SYSTEM != "Windows":
+        chrome_path = shutil.which("google-chrome") or shutil.which("chromium")
+        if chrome_path:
+            return chrome_path
     
     # If all fails, return None
     return None
 
 # Initialize and start browser with Chrome DevTools Protocol enabled
 def start_browser():
-    global browser, all_windows
+    global browser, all_windows, debugger_address, browser_alive
+    
+    start_db_writer()
+    start_liveness_monitor()
     
-    if is_browser_alive():
+    if probe_browser():
         # Browser already running
         return True
     
@@ -117,11 +169,13 @@ def start_browser():
         
         # Store the initial window handle
         all_windows = {browser.current_window_handle}
+        debugger_address = get_debugger_address(browser)
         
         # Test that browser is working
         browser.get("about:blank")
         print("Successfully loaded about:blank")
         
+        browser_alive = True
         return True
     except Exception as e:
         print(f"Error starting browser: {e}")
@@ -138,8 +192,10 @@ def start_browser():
             
             browser = webdriver.Chrome(options=chrome_options)
             all_windows = {browser.current_window_handle}
+            debugger_address = get_debugger_address(browser)
             browser.get("about:blank")
             print("Alternative setup successful")
+            browser_alive = True
             return True
         except Exception as e2:
             print(f"Alternative method also failed: {e2}")
@@ -147,13 +203,20 @@ def start_browser():
 
 # Stop browser
 def stop_browser():
-    global browser, stop_capturing
+    global browser, stop_capturing, browser_alive
     
     # First ensure capturing is stopped
     stop_capturing = True
+    capture_event.set()
     
     # Allow capture thread to finish
     time.sleep(1)
+    # Pending writes are stored on the background thread that winds down a
+    # capture; one is started here unless a stopped capture already has one
+    if finish_thread is None or not finish_thread.is_alive():
+        stop_capturing_process()
+    
+    close_cdp_sessions()
     
     # Now close the browser
     if browser:
@@ -162,283 +225,535 @@ def stop_browser():
         except Exception as e:
             print(f"Error closing browser: {e}")
         browser = None
+        browser_alive = False
 
 # Scrape Metadata
-# Enhanced extract_metadata function for better form capture
-def extract_metadata(html):
-    soup = BeautifulSoup(html, "html.parser")
-    
-    # Extract HTML meta tags
-    meta_tags = {}
-    for meta in soup.find_all("meta"):
-        name = meta.get("name") or meta.get("property")
-        content = meta.get("content")
-        if name and content:
-            meta_tags[name] = content
-    
-    # Extract title
-    title = soup.title.text.strip() if soup.title else "No Title"
-    
-    # Extract headings for summary
-    headings = []
-    for h in soup.find_all(["h1", "h2", "h3"]):
-        headings.append(h.text.strip())
-    
-    # Extract forms with enhanced field capture
-    forms = []
-    for form in soup.find_all("form"):
-        # Get form properties
-        form_data = {
-            "action": form.get("action", ""),
-            "method": form.get("method", ""),
-            "id": form.get("id", ""),
-            "name": form.get("name", ""),
-            "class": form.get("class", []),
-            "enctype": form.get("enctype", ""),
-            "target": form.get("target", ""),
-            "fields": []
-        }
-        
-        # Process all input fields
-        for inp in form.find_all("input"):
-            field = {
-                "name": inp.get("name", ""),
-                "type": inp.get("type", "text"),
-                "id": inp.get("id", ""),
-                "placeholder": inp.get("placeholder", ""),
-                "value": inp.get("value", ""),
-                "required": inp.has_attr("required"),
-                "readonly": inp.has_attr("readonly"),
-                "class": inp.get("class", []),
-                "max_length": inp.get("maxlength", ""),
-                "min_length": inp.get("minlength", ""),
-                "pattern": inp.get("pattern", "")
-            }
-            form_data["fields"].append(field)
-        
-        # Process select fields
-        for select in form.find_all("select"):
-            options = []
-            for option in select.find_all("option"):
-                options.append({
-                    "value": option.get("value", ""),
-                    "text": option.text.strip(),
-                    "selected": option.has_attr("selected")
-                })
-            
-            field = {
-                "name": select.get("name", ""),
-                "type": "select",
-                "id": select.get("id", ""),
-                "required": select.has_attr("required"),
-                "options": options,
-                "multiple": select.has_attr("multiple")
-            }
-            form_data["fields"].append(field)
-        
-        # Process textareas
-        for textarea in form.find_all("textarea"):
-            field = {
-                "name": textarea.get("name", ""),
-                "type": "textarea",
-                "id": textarea.get("id", ""),
-                "placeholder": textarea.get("placeholder", ""),
-                "value": textarea.text.strip(),
-                "required": textarea.has_attr("required"),
-                "rows": textarea.get("rows", ""),
-                "cols": textarea.get("cols", "")
-            }
-            form_data["fields"].append(field)
-        
-        # Process buttons
-        for button in form.find_all("button"):
-            field = {
-                "name": button.get("name", ""),
-                "type": button.get("type", "button"),
-                "id": button.get("id", ""),
-                "value": button.get("value", ""),
-                "text": button.text.strip()
-            }
-            form_data["fields"].append(field)
-        
-        forms.append(form_data)
-    
-    # Extract input fields outside forms
-    standalone_fields = []
-    for inp in soup.find_all("input", recursive=False):
-        field = {
-            "name": inp.get("name", ""),
-            "type": inp.get("type", "text"),
-            "id": inp.get("id", ""),
-            "value": inp.get("value", ""),
+# Handlers for the single-pass DOM walk in extract_metadata. Each one gets the
+# tag, the page accumulator and the enclosing form context (None outside a
+# form) and returns the form context the tag's children should see.
+def _handle_meta(tag, page, form):
+    attrs = tag.attrs
+    name = attrs.get("name") or attrs.get("property")
+    content = attrs.get("content")
+    if name and content:
+        page["meta_tags"][name] = content
+    return form
+
+def _handle_title(tag, page, form):
+    if page["title"] is None:
+        page["title"] = tag.text.strip()
+    return form
+
+def _handle_heading(tag, page, form):
+    page["headings"].append(tag.text.strip())
+    return form
+
+def _handle_form(tag, page, form):
+    attrs = tag.attrs
+    # Get form properties
+    form_data = {
+        "action": attrs.get("action", ""),
+        "method": attrs.get("method", ""),
+        "id": attrs.get("id", ""),
+        "name": attrs.get("name", ""),
+        "class": attrs.get("class", []),
+        "enctype": attrs.get("enctype", ""),
+        "target": attrs.get("target", ""),
+        "fields": []
+    }
+    # Fields are bucketed by kind so they keep the inputs/selects/textareas/buttons order
+    form = {"data": form_data, "input": [], "select": [], "textarea": [], "button": []}
+    page["forms"].append(form)
+    return form
+
+def _handle_input(tag, page, form):
+    attrs = tag.attrs
+    if form is None:
+        # Input fields outside forms
+        page["fields"].append({
+            "name": attrs.get("name", ""),
+            "type": attrs.get("type", "text"),
+            "id": attrs.get("id", ""),
+            "value": attrs.get("value", ""),
             "placement": "standalone"
-        }
-        standalone_fields.append(field)
-    
-    # Extract buttons/actions
-    actions = []
-    for btn in soup.find_all("button"):
-        action = {
-            "text": btn.text.strip(),
-            "type": btn.get("type", "button"),
-            "id": btn.get("id", ""),
-            "class": btn.get("class", []),
-            "data_attributes": {attr.replace("data-", ""): btn[attr] for attr in btn.attrs if attr.startswith("data-")}
-        }
-        actions.append(action)
+        })
+        return form
+    
+    form["input"].append({
+        "name": attrs.get("name", ""),
+        "type": attrs.get("type", "text"),
+        "id": attrs.get("id", ""),
+        "placeholder": attrs.get("placeholder", ""),
+        "value": attrs.get("value", ""),
+        "required": "required" in attrs,
+        "readonly": "readonly" in attrs,
+        "class": attrs.get("class", []),
+        "max_length": attrs.get("maxlength", ""),
+        "min_length": attrs.get("minlength", ""),
+        "pattern": attrs.get("pattern", "")
+    })
+    return form
+
+def _handle_select(tag, page, form):
+    attrs = tag.attrs
+    if form is None:
+        return form
+    
+    options = []
+    for option in tag.find_all("option"):
+        options.append({
+            "value": option.attrs.get("value", ""),
+            "text": option.text.strip(),
+            "selected": "selected" in option.attrs
+        })
+    
+    form["select"].append({
+        "name": attrs.get("name", ""),
+        "type": "select",
+        "id": attrs.get("id", ""),
+        "required": "required" in attrs,
+        "options": options,
+        "multiple": "multiple" in attrs
+    })
+    return form
+
+def _handle_textarea(tag, page, form):
+    attrs = tag.attrs
+    if form is None:
+        return form
+    
+    form["textarea"].append({
+        "name": attrs.get("name", ""),
+        "type": "textarea",
+        "id": attrs.get("id", ""),
+        "placeholder": attrs.get("placeholder", ""),
+        "value": tag.text.strip(),
+        "required": "required" in attrs,
+        "rows": attrs.get("rows", ""),
+        "cols": attrs.get("cols", "")
+    })
+    return form
+
+def _handle_button(tag, page, form):
+    attrs = tag.attrs
+    text = tag.text.strip()
+    
+    if form is not None:
+        form["button"].append({
+            "name": attrs.get("name", ""),
+            "type": attrs.get("type", "button"),
+            "id": attrs.get("id", ""),
+            "value": attrs.get("value", ""),
+            "text": text
+        })
+    
+    # Every button is also a page action
+    page["actions"].append({
+        "text": text,
+        "type": attrs.get("type", "button"),
+        "id": attrs.get("id", ""),
+        "class": attrs.get("class", []),
+        "data_attributes": {attr.replace("data-", ""): value for attr, value in attrs.items() if attr.startswith("data-")}
+    })
+    return form
+
+def _handle_anchor(tag, page, form):
+    attrs = tag.attrs
+    text = tag.text.strip()
     
     # Also capture <a> elements with role="button"
-    for a in soup.find_all("a", attrs={"role": "button"}):
-        action = {
-            "text": a.text.strip(),
-            "href": a.get("href", ""),
-            "id": a.get("id", ""),
-            "class": a.get("class", []),
+    if attrs.get("role") == "button":
+        page["link_actions"].append({
+            "text": text,
+            "href": attrs.get("href", ""),
+            "id": attrs.get("id", ""),
+            "class": attrs.get("class", []),
             "type": "link-button"
-        }
-        actions.append(action)
+        })
     
     # Extract links
-    links = {}
-    for a in soup.find_all("a", href=True):
-        href = a.get("href")
-        text = a.text.strip()
-        if href and text:
-            links[href] = {
-                "text": text,
-                "title": a.get("title", ""),
-                "target": a.get("target", ""),
-                "rel": a.get("rel", "")
-            }
-    
-    # Extract scripts
-    scripts = []
-    for script in soup.find_all("script"):
-        script_type = script.get("type", "")
-        if script.string and script_type != "application/ld+json":  # Exclude JSON-LD
-            # Only store script src or a short preview of inline script
-            if script.get("src"):
-                scripts.append({"src": script.get("src"), "type": script_type})
-            else:
-                # Only store a preview of inline scripts
-                script_content = script.string.strip()
-                preview = script_content[:100] + "..." if len(script_content) > 100 else script_content
-                scripts.append({"inline": preview, "type": script_type})
+    href = attrs.get("href")
+    if href and text:
+        page["links"][href] = {
+            "text": text,
+            "title": attrs.get("title", ""),
+            "target": attrs.get("target", ""),
+            "rel": attrs.get("rel", "")
+        }
+    return form
+
+def _handle_script(tag, page, form):
+    attrs = tag.attrs
+    script_type = attrs.get("type", "")
+    if tag.string and script_type != "application/ld+json":  # Exclude JSON-LD
+        # Only store script src or a short preview of inline script
+        if attrs.get("src"):
+            page["scripts"].append({"src": attrs.get("src"), "type": script_type})
+        else:
+            # Only store a preview of inline scripts
+            script_content = tag.string.strip()
+            preview = script_content[:100] + "..." if len(script_content) > 100 else script_content
+            page["scripts"].append({"inline": preview, "type": script_type})
+    return form
+
+SUMMARY_WORDS = 100
+
+METADATA_TAG_HANDLERS = {
+    "meta": _handle_meta,
+    "title": _handle_title,
+    "h1": _handle_heading,
+    "h2": _handle_heading,
+    "h3": _handle_heading,
+    "form": _handle_form,
+    "input": _handle_input,
+    "select": _handle_select,
+    "textarea": _handle_textarea,
+    "button": _handle_button,
+    "a": _handle_anchor,
+    "script": _handle_script,
+}
+
+# Enhanced extract_metadata function for better form capture
+def extract_metadata(html):
+    # lxml's C parser is several times faster than the pure-Python html.parser
+    soup = BeautifulSoup(html, "lxml")
+    
+    page = {
+        "title": None,
+        "meta_tags": {},
+        "headings": [],
+        "forms": [],
+        "fields": [],
+        "actions": [],
+        "link_actions": [],
+        "links": {},
+        "scripts": []
+    }
+    
+    # Walk the tree once, carrying the enclosing form down to descendants and
+    # collecting summary words only until there are enough of them
+    words = []
+    stack = [(soup, None)]
+    while stack:
+        node, form = stack.pop()
+        if type(node) is NavigableString:
+            if len(words) <= SUMMARY_WORDS:
+                words.extend(node.split())
+            continue
+        
+        handler = METADATA_TAG_HANDLERS.get(node.name)
+        if handler:
+            form = handler(node, page, form)
+        
+        # Script/style strings are their own NavigableString subclasses, so the
+        # exact type check below already leaves them out of the summary
+        collect_text = len(words) <= SUMMARY_WORDS and node.name != "noscript"
+        stack.extend((child, form) for child in reversed(node.contents)
+                     if isinstance(child, Tag) or (collect_text and type(child) is NavigableString))
+    
+    forms = []
+    for form in page["forms"]:
+        form_data = form["data"]
+        form_data["fields"] = form["input"] + form["select"] + form["textarea"] + form["button"]
+        forms.append(form_data)
     
     # Create a page summary (first 100 words)
-    text_content = soup.get_text().strip()
-    words = text_content.split()
-    summary = " ".join(words[:100]) + ("..." if len(words) > 100 else "")
+    summary = " ".join(words[:SUMMARY_WORDS]) + ("..." if len(words) > SUMMARY_WORDS else "")
     
     return {
-        "title": title,
-        "meta_tags": meta_tags,
-        "headings": headings[:5],  # First 5 headings
+        "title": page["title"] if page["title"] is not None else "No Title",
+        "meta_tags": page["meta_tags"],
+        "headings": page["headings"][:5],  # First 5 headings
         "forms": forms,
-        "fields": standalone_fields,
-        "actions": actions,
-        "links": links,
-        "scripts": scripts,
+        "fields": page["fields"],
+        "actions": page["actions"] + page["link_actions"],
+        "links": page["links"],
+        "scripts": page["scripts"],
         "summary": summary
     }
 
+# Stable 64-bit digest of page content; unlike hash() it is the same in every run,
+# and xxh3 is several times faster than SipHash on multi-MB pages
+def content_digest(html):
+    return xxhash.xxh3_64_intdigest(html.encode("utf-8", "ignore"))
+
+# Metadata for a page, parsed only if this exact content wasn't seen recently
+def get_metadata(html, content_hash):
+    metadata = metadata_cache.get(content_hash)
+    if metadata is None:
+        metadata = extract_metadata(html)
+        metadata_cache[content_hash] = metadata
+        if len(metadata_cache) > METADATA_CACHE_SIZE:
+            metadata_cache.popitem(last=False)
+    else:
+        metadata_cache.move_to_end(content_hash)
+    return metadata
+
 # Record user action
-def record_action(url, metadata, content, referrer=None):
-    if url not in flows:
-        flows[url] = {"metadata": metadata, "content": content}
-    
+def record_action(url, metadata, content, referrer=None, content_hash=None):
     # Get current session ID
     session_id = None
     from database.history_manager import history_manager
     if history_manager.current_session:
         session_id = history_manager.current_session.id
     
+    # Hand off to the background writer; blocks only if the writer falls far behind
+    write_queue.put((url, metadata, content, referrer, session_id, content_hash))
+
+# Persist one captured page to both databases
+def persist_action(url, metadata, content, referrer, session_id, content_hash=None):
+    # Only the sections that changed since the last write in this session are resent
+    previous = None
+    if url in flows and flows[url]["session_id"] == session_id:
+        previous = flows[url]["metadata"]
+    
     # Store in databases with explicit session ID
-    store_in_neo4j(url, metadata, referrer, session_id)
-    store_in_pgvector(url, content, metadata, session_id)
+    if store_in_neo4j(url, metadata, referrer, session_id, previous):
+        # Only what the next delta write needs; the page HTML is not kept around
+        flows[url] = {"metadata": metadata, "session_id": session_id}
+    store_in_pgvector(url, content, metadata, session_id, content_hash)
+
+# Drain the write queue, keeping only the latest capture of each page
+def flush_write_queue():
+    with write_lock:
+        # Keyed by page and referrer so navigation edges are kept; a page keeps
+        # its first slot so it is stored before pages that it leads to
+        batch = {}
+        while True:
+            try:
+                url, metadata, content, referrer, session_id, content_hash = write_queue.get_nowait()
+            except queue.Empty:
+                break
+            batch[(url, referrer, session_id)] = (metadata, content, content_hash)
+        
+        for (url, referrer, session_id), (metadata, content, content_hash) in batch.items():
+            try:
+                persist_action(url, metadata, content, referrer, session_id, content_hash)
+            except Exception as e:
+                print(f"Error persisting {url}: {e}")
+
+# Background writer loop
+def db_writer():
+    while True:
+        time.sleep(0.2)
+        flush_write_queue()
+
+# Start the background writer once
+def start_db_writer():
+    global db_writer_thread
+    if db_writer_thread is None or not db_writer_thread.is_alive():
+        db_writer_thread = threading.Thread(target=db_writer, daemon=True)
+        db_writer_thread.start()
+
+# Name of the CDP binding pages use to report DOM changes back to Python
+PUSH_BINDING = "__flowPush"
+
+# DOM change observer, registered once per tab so Chrome runs it in every new
+# document; it counts mutations and pushes them through the binding, so idle
+# tabs cost no round-trips at all
+OBSERVER_SCRIPT = """
+(function() {
+    if (window.__flowObserverInstalled) {
+        return;
+    }
+    window.__flowObserverInstalled = true;
+    window.__flowMutationCount = 0;
+    var pushTimer = null;
+    
+    new MutationObserver(function(mutations) {
+        window.__flowMutationCount += mutations.length;
+        
+        // Coalesce bursts (typing, streaming updates) into one push per 250ms;
+        // the timer is not reset, so a steady stream still reports regularly
+        if (pushTimer === null && typeof window.__flowPush === "function") {
+            pushTimer = setTimeout(function() {
+                pushTimer = null;
+                window.__flowPush(String(window.__flowMutationCount));
+            }, 250);
+        }
+    }).observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+})()
+"""
+
+# Cheap per-tab change signature, so the full HTML only crosses the socket
+# when something actually changed
+TAB_SIGNATURE_SCRIPT = """
+({
+    url: location.href,
+    title: document.title,
+    sig: [performance.timeOrigin, location.href, window.__flowMutationCount || 0, document.forms.length].join(":")
+})
+"""
+
+TAB_HTML_SCRIPT = "document.documentElement ? document.documentElement.outerHTML : ''"
+
+# Open a DevTools session for a tab and subscribe to its change notifications
+def open_cdp_session(target):
+    target_id = target["id"]
+    session = CDPSession(target_id, target["webSocketDebuggerUrl"])
+    
+    def on_binding_called(params):
+        if params.get("name") == PUSH_BINDING:
+            mark_dirty(target_id)
+    
+    def on_frame_navigated(params):
+        # Only main-frame navigations replace the document we observe
+        if not params.get("frame", {}).get("parentId"):
+            mark_dirty(target_id)
+    
+    def on_dialog_opening(params):
+        # Leave dialogs to the user when not capturing
+        if stop_capturing:
+            return
+        record_alert(params.get("url", ""), params.get("message", ""))
+        
+        # Accept the alert and continue; post() because this runs on the reader thread
+        session.post("Page.handleJavaScriptDialog", {"accept": True})
+    
+    session.on("Runtime.bindingCalled", on_binding_called)
+    session.on("Page.javascriptDialogOpening", on_dialog_opening)
+    session.on("Page.frameNavigated", on_frame_navigated)
+    session.on("Page.loadEventFired", lambda params: mark_dirty(target_id))
+    # Fragment and History API navigations keep the document, and may not touch the DOM
+    session.on("Page.navigatedWithinDocument", lambda params: mark_dirty(target_id))
+    
+    try:
+        session.send("Runtime.enable")
+        session.send("Page.enable")
+        session.send("Runtime.addBinding", {"name": PUSH_BINDING})
+        
+        # Chrome injects the observer into every later document by itself;
+        # the current document gets it once here
+        session.send("Page.addScriptToEvaluateOnNewDocument", {"source": OBSERVER_SCRIPT})
+        session.evaluate(OBSERVER_SCRIPT)
+    except Exception:
+        session.close()
+        raise
+    return session
+
+# Flag a tab for a snapshot and wake the capture loop
+def mark_dirty(target_id):
+    dirty_targets.add(target_id)
+    capture_event.set()
+
+# Get (or open) the DevTools session for a tab
+def get_cdp_session(target):
+    session = cdp_sessions.get(target["id"])
+    if session is None or session.closed:
+        session = open_cdp_session(target)
+        cdp_sessions[target["id"]] = session
+    return session
+
+# Tabs that need a snapshot: new or reconnected sessions, plus any that
+# reported a change since the last tick
+def targets_to_capture(targets):
+    changed = set(dirty_targets)
+    dirty_targets.difference_update(changed)
+    
+    pending = []
+    for target in targets:
+        session = cdp_sessions.get(target["id"])
+        if session is None or session.closed or target["id"] in changed:
+            pending.append(target)
+    return pending
+
+# Close DevTools sessions, either all of them or those not in keep_ids
+def close_cdp_sessions(keep_ids=None):
+    for target_id in list(cdp_sessions):
+        if keep_ids is None or target_id not in keep_ids:
+            cdp_sessions.pop(target_id).close()
+            last_sig_by_target.pop(target_id, None)
+            dirty_targets.discard(target_id)
+
+# Snapshot a single tab over its own DevTools session, fetching HTML only on change
+def capture_one_target(target):
+    session = get_cdp_session(target)
+    snapshot = session.evaluate(TAB_SIGNATURE_SCRIPT) or {}
+    
+    if snapshot.get("sig") != last_sig_by_target.get(target["id"]):
+        snapshot["html"] = session.evaluate(TAB_HTML_SCRIPT) or ""
+        last_sig_by_target[target["id"]] = snapshot.get("sig")
+    
+    return snapshot
+
+# Snapshot the focused tab, always including its HTML
+def capture_focused_tab():
+    # Tabs come back most recently focused first
+    target = list_page_targets(debugger_address)[0]
+    last_sig_by_target.pop(target["id"], None)
+    return capture_one_target(target)
 
 # Capture all tabs and windows
 def capture_all_tabs():
-    global browser, all_windows
+    global all_windows
     
-    current_handle = browser.current_window_handle
-    current_url = browser.current_url
     results = []
+    current_url = None
     
     try:
-        # Check for new windows
-        current_handles = set(browser.window_handles)
+        # Tabs come back most recently focused first
+        targets = list_page_targets(debugger_address)
+        
+        # Check for new windows (window handles are DevTools target IDs)
+        target_ids = [target["id"] for target in targets]
+        current_handles = set(target_ids)
         new_handles = current_handles - all_windows
         all_windows = current_handles
+        close_cdp_sessions(keep_ids=current_handles)
+        
+        if targets:
+            current_url = targets[0].get("url")
         
-        # Process all windows
-        for handle in browser.window_handles:
+        # Snapshot changed tabs in parallel, one DevTools socket per tab
+        pending = targets_to_capture(targets)
+        futures = [capture_executor.submit(capture_one_target, target) for target in pending]
+        
+        for target, future in zip(pending, futures):
+            target_id = target["id"]
             try:
-                # Switch to this window
-                browser.switch_to.window(handle)
-                
-                # Get the URL and content
-                url = browser.current_url
-                html_content = browser.page_source
+                snapshot = future.result()
+                url = snapshot.get("url", "")
                 
-                # Skip about:blank pages
-                if url == "about:blank":
+                # Skip about:blank pages and tabs whose signature is unchanged
+                if not url or url == "about:blank" or "html" not in snapshot:
                     continue
                     
                 results.append({
                     "url": url,
-                    "content": html_content,
-                    "is_new": handle in new_handles
+                    "title": snapshot.get("title", ""),
+                    "content": snapshot["html"],
+                    "is_new": target_id in new_handles
                 })
             except Exception as e:
-                print(f"Error capturing tab {handle}: {e}")
+                # Try this tab again on the next tick
+                dirty_targets.add(target_id)
+                print(f"Error capturing tab {target_id}: {e}")
     except Exception as e:
         print(f"Error in tab capture: {e}")
-    finally:
-        # Switch back to original window
-        try:
-            browser.switch_to.window(current_handle)
-        except:
-            # If original window is closed, switch to the first available
-            if browser.window_handles:
-                browser.switch_to.window(browser.window_handles[0])
+        # Listing tabs failed; find out now whether the browser went away
+        probe_browser()
     
     return results, current_url
 
-# Check and process alerts/popups
-def check_alerts():
-    global browser
+# Record a JavaScript dialog reported by a tab's DevTools session
+def record_alert(url, alert_text):
+    alert_content = f"<html><body><h1>Alert on {url}</h1><p>{alert_text}</p></body></html>"
+    alert_metadata = {
+        "title": f"Alert on {url}",
+        "meta_tags": {},
+        "headings": ["Alert"],
+        "fields": [],
+        "actions": ["OK", "Cancel"],
+        "forms": [],
+        "links": {},
+        "summary": alert_text,
+        "is_alert": True
+    }
     
-    try:
-        # Try to switch to an alert with a very short timeout
-        alert = WebDriverWait(browser, 0.5).until(EC.alert_is_present())
-        alert_text = alert.text
-        
-        # Record the alert
-        url = browser.current_url
-        alert_content = f"<html><body><h1>Alert on {url}</h1><p>{alert_text}</p></body></html>"
-        alert_metadata = {
-            "title": f"Alert on {url}",
-            "meta_tags": {},
-            "headings": ["Alert"],
-            "fields": [],
-            "actions": ["OK", "Cancel"],
-            "forms": [],
-            "links": {},
-            "summary": alert_text,
-            "is_alert": True
-        }
-        
-        # Record this as a special type of action
-        alert_url = f"{url}#alert-{int(time.time())}"
-        record_action(alert_url, alert_metadata, alert_content, url)
-        signals.update_status.emit(f"Captured alert: {alert_text[:30]}...")
-        
-        # Accept the alert and continue
-        alert.accept()
-        return True
-    except:
-        return False
+    # Record this as a special type of action
+    alert_url = f"{url}#alert-{int(time.time())}"
+    record_action(alert_url, alert_metadata, alert_content, url)
+    signals.update_status.emit(f"Captured alert: {alert_text[:30]}...")
 
 # Continuously capture web actions
 def capture_web_actions():
@@ -460,15 +775,17 @@ def capture_web_actions():
         print(f"✓ Opened target website: {TARGET_WEBSITE}")
         
         # Store initial page
-        url = browser.current_url
-        html_content = browser.page_source
-        metadata = extract_metadata(html_content)
-        record_action(url, metadata, html_content)
+        snapshot = capture_focused_tab()
+        url = snapshot.get("url") or TARGET_WEBSITE
+        html_content = snapshot.get("html", "")
+        last_content_hash = content_digest(html_content)
+        metadata = get_metadata(html_content, last_content_hash)
+        record_action(url, metadata, html_content, content_hash=last_content_hash)
         signals.update_status.emit(f"Captured initial page: {url}")
         
         last_url = url
-        last_content_hash = hash(html_content)
         processed_urls = {url: last_content_hash}
+        last_pass = time.monotonic()
         
         # Continuously monitor for page changes
         while not stop_capturing:
@@ -477,22 +794,31 @@ def capture_web_actions():
                 signals.error.emit("Browser Error", "Browser window was closed")
                 break
             
-            # Check for alerts first
-            if check_alerts():
-                continue
-                
             try:
+                # Changes reported during the last pass are picked up once the
+                # minimum interval since it began has passed
+                remaining = last_pass + CAPTURE_MIN_INTERVAL - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+                    if stop_capturing:
+                        break
+                last_pass = time.monotonic()
+                
+                # Cleared before capturing, so changes reported mid-capture
+                # leave it set and trigger the next pass straight away
+                capture_event.clear()
+                
                 # Capture all tabs/windows
                 tabs_data, current_url = capture_all_tabs()
                 
                 for tab_data in tabs_data:
                     tab_url = tab_data["url"]
                     html_content = tab_data["content"]
-                    content_hash = hash(html_content)
+                    content_hash = content_digest(html_content)
                     
                     # If this is a new URL or content has changed
                     if tab_url not in processed_urls or processed_urls[tab_url] != content_hash:
-                        metadata = extract_metadata(html_content)
+                        metadata = get_metadata(html_content, content_hash)
                         
                         # Determine referrer
                         referrer = None
@@ -503,7 +829,7 @@ def capture_web_actions():
                             referrer = tab_url
                         
                         # Record the action
-                        record_action(tab_url, metadata, html_content, referrer)
+                        record_action(tab_url, metadata, html_content, referrer, content_hash)
                         
                         # Update status
                         if tab_url not in processed_urls:
@@ -517,17 +843,17 @@ def capture_web_actions():
                         processed_urls[tab_url] = content_hash
                 
                 # Update last URL if changed
-                if current_url != last_url:
+                if current_url and current_url != last_url:
                     last_url = current_url
                 
-                # Brief pause to avoid high CPU usage
-                time.sleep(0.5)
+                # Sleep until a tab reports a navigation or DOM change
+                capture_event.wait(CAPTURE_IDLE_TIMEOUT)
                 
             except Exception as e:
                 # Handle WebDriver exceptions that can occur if the page is navigating
                 print(f"Temporary error in capture loop: {e}")
                 time.sleep(1)  # Give browser time to settle
-                if not is_browser_alive():
+                if not probe_browser():
                     break
             
     except Exception as e:
@@ -563,17 +889,45 @@ def start_capturing(target_url):
         signals.error.emit("Navigation Error", f"Could not navigate to {TARGET_WEBSITE}: {e}")
         return None
     
+    # Every open tab is snapshotted into the new session, changed or not
+    last_sig_by_target.clear()
+    for target_id in list(cdp_sessions):
+        mark_dirty(target_id)
+    
+    # Large sessions drop the similarity index and rebuild it once they end
+    prepare_bulk_load()
+    
     # Start capturing thread
     capture_thread = threading.Thread(target=capture_web_actions, daemon=True)
     capture_thread.start()
     
     return capture_thread
 
-# Stop the capture process
+# Wind down a capture session off the UI thread: persist anything still
+# queued, tell the UI the session's pages are stored, then rebuild the index
+def finish_capture_session():
+    # Wait for thread to end
+    if capture_thread and capture_thread.is_alive():
+        capture_thread.join(timeout=2)
+    
+    flush_write_queue()
+    flush_pending_embeddings()
+    capture_flushed.set()
+    signals.capture_stopped.emit()
+    
+    finalize_bulk_load()
+
+# Stop the capture process; capture_stopped is emitted once pending writes are stored
 def stop_capturing_process():
-    global stop_capturing
+    global stop_capturing, finish_thread
     stop_capturing = True
+    capture_event.set()
     
-    # Wait for thread to end
-    if capture_thread and capture_thread.is_alive():
-        capture_thread.join(timeout=2)
\ No newline at end of file
+    capture_flushed.clear()
+    finish_thread = threading.Thread(target=finish_capture_session, daemon=True)
+    finish_thread.start()
+    return finish_thread
+
+# Block until a stopped capture's pending writes are stored (not the index rebuild)
+def wait_for_capture_flush():
+    capture_flushed.wait()
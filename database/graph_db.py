@@ -100,7 +100,10 @@ def init_database():
 # Store in Neo4j
 
 
-def store_in_neo4j(url, metadata, referrer=None, session_id=None):
+def store_in_neo4j(url, metadata, referrer=None, session_id=None, previous=None):
+    """Store a page in Neo4j; with the previously stored metadata for the same
+    url and session, only the sections that changed are rewritten"""
+    previous = previous or {}
     with driver.session() as session:
         try:
             # Determine if this is a special page type
@@ -132,7 +135,7 @@ def store_in_neo4j(url, metadata, referrer=None, session_id=None):
 
             # Store headings
             headings = metadata.get("headings", [])
-            if headings:
+            if headings and headings != previous.get("headings"):
                 session.run("""
                 MATCH (p {url: $url})
                 SET p.headings = $headings
@@ -140,7 +143,7 @@ def store_in_neo4j(url, metadata, referrer=None, session_id=None):
 
             # Store standalone fields
             fields = metadata.get("fields", [])
-            if fields:
+            if fields and fields != previous.get("fields"):
                 session.run("""
                 MATCH (p {url: $url})
                 SET p.standalone_fields = $fields
@@ -148,7 +151,7 @@ def store_in_neo4j(url, metadata, referrer=None, session_id=None):
 
             # Store actions
             actions = metadata.get("actions", [])
-            if actions:
+            if actions and actions != previous.get("actions"):
                 session.run("""
                 MATCH (p {url: $url})
                 SET p.actions = $actions
@@ -156,14 +159,17 @@ def store_in_neo4j(url, metadata, referrer=None, session_id=None):
 
             # Store scripts
             scripts = metadata.get("scripts", [])
-            if scripts:
+            if scripts and scripts != previous.get("scripts"):
                 session.run("""
                 MATCH (p {url: $url})
                 SET p.scripts = $scripts
                 """, url=url, scripts=str(scripts))
 
             # Store meta tags as separate properties
+            previous_meta_tags = previous.get("meta_tags", {})
             for key, value in metadata.get("meta_tags", {}).items():
+                if previous_meta_tags.get(key) == value:
+                    continue
                 # Replace dots and special characters in property names
                 safe_key = key.replace(".", "_").replace(
                     ":", "_").replace("-", "_")
@@ -187,8 +193,12 @@ def store_in_neo4j(url, metadata, referrer=None, session_id=None):
                 G.add_node(url)
 
             # Store forms as separate nodes connected to the page
+            forms = metadata.get("forms", [])
+            if forms == previous.get("forms"):
+                # Form subgraph is unchanged since the last write
+                forms = []
             form_index = 0
-            for form in metadata.get("forms", []):
+            for form in forms:
                 form_id = f"{url}_form_{form_index}"
 
                 # Create the Form node with basic properties
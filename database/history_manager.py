@@ -3,7 +3,7 @@ import json
 import time
 from datetime import datetime
 from database.graph_db import driver
-from database.vector_db import PG_CONN, PG_CURSOR
+from database.vector_db import pg_cursor
 
 
 class CaptureSession:
@@ -240,14 +240,22 @@ class HistoryManager:
 
         # Then remove from vector DB
         try:
-            PG_CURSOR.execute("""
-            DELETE FROM page_embeddings
-            WHERE session_id = %s
-            """, (session_id,))
-            PG_CONN.commit()
+            with pg_cursor() as cursor:
+                # Staged rows too, or the next merge would bring them back
+                for table in ("page_embeddings", "page_embeddings_staging"):
+                    cursor.execute(f"""
+                    DELETE FROM {table}
+                    WHERE session_id = %s
+                    """, (session_id,))
+                
+                # Page text no remaining page refers to
+                cursor.execute("""
+                DELETE FROM page_content AS c
+                WHERE NOT EXISTS (SELECT 1 FROM page_embeddings AS p WHERE p.content_hash = c.content_hash)
+                AND NOT EXISTS (SELECT 1 FROM page_embeddings_staging AS s WHERE s.content_hash = c.content_hash)
+                """)
         except Exception as e:
             print(f"Error deleting session from vector DB: {e}")
-            PG_CONN.rollback()
 
         # Remove from history
         self.sessions = [s for s in self.sessions if s.id != session_id]
@@ -1,12 +1,43 @@
+import os
+import platform
 import time
-import psycopg2
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from pgvector.psycopg2 import register_vector
+from contextlib import contextmanager
+from collections import OrderedDict
 import numpy as np
+import xxhash
+import zstandard
 from sentence_transformers import SentenceTransformer
 from bs4 import BeautifulSoup
+import lxml.html
+from lxml.etree import ParserError
 from datetime import datetime
 
-# Initialize embedding model
-model = SentenceTransformer("all-MiniLM-L6-v2")
+# Int8-quantized ONNX export of the model built for this CPU; the model repo
+# ships one per instruction set (VNNI on AVX-512, AVX2, ARM64)
+def _onnx_model_file():
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "onnx/model_qint8_arm64.onnx"
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            if "avx512_vnni" in cpuinfo.read():
+                return "onnx/model_qint8_avx512_vnni.onnx"
+    except OSError:
+        pass
+    return "onnx/model_quint8_avx2.onnx"
+
+# Initialize embedding model, on ONNX Runtime when it is available
+try:
+    model = SentenceTransformer("all-MiniLM-L6-v2", backend="onnx",
+                                model_kwargs={"file_name": _onnx_model_file()})
+except Exception as e:
+    print(f"ONNX embedding model unavailable, using PyTorch: {e}")
+    model = SentenceTransformer("all-MiniLM-L6-v2")
 
 # Vector Database (PostgreSQL with pgvector) Connection
 DB_CONFIG = {
@@ -16,224 +47,766 @@ DB_CONFIG = {
     "host": "localhost"
 }
 
-# Global connection and cursor
-PG_CONN = None
-PG_CURSOR = None
+# Connection pool shared by the ingest worker and the UI; each caller borrows
+# its own connection, so no cursor is ever shared between threads
+PG_POOL = None
+POOL_MIN_SIZE = 2
+POOL_MAX_SIZE = 8
+pool_lock = threading.Lock()
+# Set once the pool is closed at shutdown, so late callers don't open it again
+pool_closed = False
+
+# Pages waiting to be embedded. A background worker takes them off the queue
+# in batches (up to EMBEDDING_BATCH_SIZE pages, or whatever arrived within
+# INGEST_BATCH_WAIT seconds) so the model runs one forward pass per batch and
+# callers never wait on it
+EMBEDDING_BATCH_SIZE = 32
+INGEST_BATCH_WAIT = 0.1
+ingest_queue = queue.Queue(maxsize=1024)
+ingest_thread = None
+ingest_lock = threading.Lock()
+# New embeddings land in an UNLOGGED staging table (no WAL) and are merged into
+# page_embeddings every STAGING_MERGE_INTERVAL seconds and when ingestion is flushed
+STAGING_MERGE_INTERVAL = 5
+merge_lock = threading.Lock()
+# Text extraction and MinHash for a batch run in parallel; lxml and numpy
+# release the GIL for most of that work
+prepare_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+# Similarity search across all sessions is two-stage: the closest CANDIDATE_POOL
+# pages by Hamming distance between sign-quantized embeddings (48 bytes a row),
+# then exact re-ranking of just those against the half-precision embeddings.
+# Embeddings are unit length, so the inner product is the cosine similarity
+# without pgvector normalizing both vectors for every row
+CANDIDATE_POOL = 200
+# HNSW graph parameters, and the candidate list size per query; ef_search caps
+# how many rows an index scan returns, so it is at least CANDIDATE_POOL. It is
+# set as a startup option of every pooled connection
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 64
+HNSW_EF_SEARCH = CANDIDATE_POOL
+# During a capture session the HNSW index is dropped only once the session has
+# merged BULK_LOAD_DROP_FRACTION of the table's rows (and at least
+# BULK_LOAD_MIN_ROWS), then rebuilt when the session ends. A short session on a
+# long history keeps maintaining the index instead of rebuilding all of it
+BULK_LOAD_DROP_FRACTION = 0.2
+BULK_LOAD_MIN_ROWS = 1000
+bulk_load = None
+
+# Page text is stored zstd-compressed in page_content, once per content digest,
+# so page_embeddings rows (and the pages vector scans touch) stay small.
+# The compressor is only used by the ingest worker
+ZSTD_LEVEL = 3
+content_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+
+# Text, MinHash and embedding of recently seen HTML, keyed by content digest, so
+# the same page seen again (another tab, a retry) skips parsing and the model
+FEATURE_CACHE_SIZE = 1024
+feature_cache = OrderedDict()
+feature_lock = threading.Lock()
+
+# MinHash over word shingles of the page text; a changed page whose estimated
+# Jaccard similarity to the stored version is at least NEAR_DUPLICATE_SIMILARITY
+# (a clock or counter ticking over) keeps its stored embedding
+MINHASH_PERMUTATIONS = 128
+MINHASH_SHINGLE_WORDS = 5
+# Shingles hashed per step; bounds the permutations x shingles matrix to 1 MB
+MINHASH_CHUNK_SIZE = 1024
+NEAR_DUPLICATE_SIMILARITY = 0.95
+# Fixed seed so signatures stay comparable across runs
+_minhash_rng = np.random.default_rng(20240101)
+MINHASH_A = _minhash_rng.integers(1, 2**63, MINHASH_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+MINHASH_B = _minhash_rng.integers(0, 2**63, MINHASH_PERMUTATIONS, dtype=np.uint64)
 
 def connect_to_db():
-    """Create a connection to the PostgreSQL database"""
-    global PG_CONN, PG_CURSOR
+    """Create the PostgreSQL connection pool if it doesn't exist yet"""
+    global PG_POOL
     
+    with pool_lock:
+        if PG_POOL is not None:
+            return True
+        if pool_closed:
+            return False
+        try:
+            PG_POOL = ThreadedConnectionPool(
+                POOL_MIN_SIZE, POOL_MAX_SIZE,
+                options=f"-c hnsw.ef_search={HNSW_EF_SEARCH}",
+                **DB_CONFIG
+            )
+            return True
+        except Exception as e:
+            print(f"Error connecting to PostgreSQL: {e}")
+            return False
+
+# Borrow a pooled connection for one transaction
+@contextmanager
+def pg_cursor():
+    """Yield a cursor; the transaction commits on success and rolls back on error"""
+    pool = PG_POOL
+    conn = pool.getconn()
     try:
-        PG_CONN = psycopg2.connect(**DB_CONFIG)
-        PG_CURSOR = PG_CONN.cursor()
-        return True
-    except Exception as e:
-        print(f"Error connecting to PostgreSQL: {e}")
-        return False
+        with conn.cursor() as cursor:
+            yield cursor
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        # A connection the server dropped is replaced rather than handed out again
+        pool.putconn(conn, close=bool(conn.closed))
+        # The pool also closes idle connections beyond its minimum; whatever was
+        # prepared on a closed connection is gone with it
+        if conn.closed:
+            prepared_connections.discard(id(conn))
 
 def init_database():
     """Initialize the database with required tables and extensions"""
-    global PG_CONN, PG_CURSOR
-    
-    if not PG_CONN or not PG_CURSOR:
-        if not connect_to_db():
-            return False
+    if not connect_to_db():
+        return False
     
     try:
-        # Check if pgvector extension exists
-        PG_CURSOR.execute("SELECT EXISTS(SELECT 1 FROM pg_extension WHERE extname = 'vector')")
-        has_vector = PG_CURSOR.fetchone()[0]
+        with pg_cursor() as cursor:
+            # Check if pgvector extension exists
+            cursor.execute("SELECT EXISTS(SELECT 1 FROM pg_extension WHERE extname = 'vector')")
+            has_vector = cursor.fetchone()[0]
+        
+            if not has_vector:
+                # Create pgvector extension
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            
+            # NumPy embeddings are sent as vector literals directly, for every
+            # pooled connection, instead of going through Python lists and ARRAY casts
+            register_vector(cursor, globally=True)
+        
+            # Create improved table with additional columns
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS page_embeddings (
+                url TEXT PRIMARY KEY, 
+                embedding halfvec(384), 
+                content TEXT, 
+                content_type TEXT DEFAULT 'html',
+                timestamp FLOAT,
+                title TEXT,
+                is_alert BOOLEAN DEFAULT false,
+                session_id TEXT,
+                content_hash BYTEA,
+                minhash BYTEA,
+                embedding_bin bit(384) GENERATED ALWAYS AS (binary_quantize(embedding)::bit(384)) STORED
+            );
+            """)
         
-        if not has_vector:
-            # Create pgvector extension
-            PG_CURSOR.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            # Tables created with full-precision embeddings; the old index on them goes too
+            cursor.execute("""
+            SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+            WHERE attrelid = 'page_embeddings'::regclass AND attname = 'embedding'
+            """)
+            if cursor.fetchone()[0] != "halfvec(384)":
+                cursor.execute("DROP INDEX IF EXISTS page_embeddings_embedding_idx")
+                cursor.execute("""
+                ALTER TABLE page_embeddings
+                ALTER COLUMN embedding TYPE halfvec(384) USING embedding::halfvec(384)
+                """)
+            cursor.execute("""
+            ALTER TABLE page_embeddings ADD COLUMN IF NOT EXISTS embedding_bin bit(384)
+            GENERATED ALWAYS AS (binary_quantize(embedding)::bit(384)) STORED
+            """)
         
-        # Create improved table with additional columns
-        PG_CURSOR.execute("""
-        CREATE TABLE IF NOT EXISTS page_embeddings (
-            url TEXT PRIMARY KEY, 
-            embedding vector(384), 
-            content TEXT, 
-            content_type TEXT DEFAULT 'html',
-            timestamp FLOAT,
-            title TEXT,
-            is_alert BOOLEAN DEFAULT false,
-            session_id TEXT
-        );
-        """)
+            # Tables created before content hashes were stored
+            cursor.execute("ALTER TABLE page_embeddings ADD COLUMN IF NOT EXISTS content_hash BYTEA")
+            cursor.execute("ALTER TABLE page_embeddings ADD COLUMN IF NOT EXISTS minhash BYTEA")
         
-        # Create index for faster similarity search
-        PG_CURSOR.execute("""
-        CREATE INDEX IF NOT EXISTS page_embeddings_embedding_idx 
-        ON page_embeddings USING ivfflat (embedding vector_cosine_ops)
-        WITH (lists = 100);
-        """)
+            # Create index for faster similarity search (the IVFFlat one it replaces goes)
+            cursor.execute("DROP INDEX IF EXISTS page_embeddings_embedding_bin_idx")
+            create_embedding_index(cursor)
         
-        # Create index for session_id for faster filtering
-        PG_CURSOR.execute("""
-        CREATE INDEX IF NOT EXISTS page_embeddings_session_idx 
-        ON page_embeddings (session_id);
-        """)
+            # Create index for session_id for faster filtering; timestamp is part of
+            # the key so a session's pages come out newest first without a sort.
+            # It replaces the old session_id-only index, so writes still maintain one
+            cursor.execute("DROP INDEX IF EXISTS page_embeddings_session_idx")
+            cursor.execute("""
+            CREATE INDEX IF NOT EXISTS page_embeddings_session_time_idx 
+            ON page_embeddings (session_id, timestamp DESC);
+            """)
+            
+            # Compressed page text, shared by every page with the same content
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS page_content (
+                content_hash BYTEA PRIMARY KEY,
+                content_zst BYTEA NOT NULL
+            );
+            """)
+            
+            # Lets a merge check whether a replaced page version's text is still in use
+            cursor.execute("""
+            CREATE INDEX IF NOT EXISTS page_embeddings_content_hash_idx 
+            ON page_embeddings (content_hash);
+            """)
+            
+            # Staging table for freshly embedded pages; no indexes, no WAL
+            cursor.execute("""
+            CREATE UNLOGGED TABLE IF NOT EXISTS page_embeddings_staging
+            (LIKE page_embeddings INCLUDING DEFAULTS);
+            """)
+            # Insertion order; several staged versions of a page can share a
+            # timestamp once a near duplicate refreshes them, so it picks the latest
+            cursor.execute("ALTER TABLE page_embeddings_staging ADD COLUMN IF NOT EXISTS seq BIGSERIAL")
+            
+            # Anything a previous run staged but never merged
+            _merge_staging_rows(cursor)
         
-        PG_CONN.commit()
-        return True
+            return True
     except Exception as e:
         print(f"Error setting up vector DB: {e}")
-        PG_CONN.rollback()
         return False
 
-# Store in Vector DB
-def store_in_pgvector(url, content, metadata=None, session_id=None):
-    """Store page content and embeddings in the vector database"""
-    global PG_CONN, PG_CURSOR
+# Build the similarity index
+def create_embedding_index(cursor):
+    """Create the HNSW index if it doesn't exist"""
+    # The index serves the Hamming-distance candidate stage of similarity search;
+    # unlike IVFFlat it has no lists to size for the data, and recall doesn't
+    # depend on how many of them a query probes
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS page_embeddings_embedding_bin_hnsw_idx 
+    ON page_embeddings USING hnsw (embedding_bin bit_hamming_ops)
+    WITH (m = %s, ef_construction = %s);
+    """, (HNSW_M, HNSW_EF_CONSTRUCTION))
+
+# Start counting the rows a capture session writes; the similarity index is
+# dropped once there are enough of them that building it again afterwards is
+# cheaper than updating it for every insert
+def prepare_bulk_load():
+    """Track a capture session's writes against the embedding index"""
+    global bulk_load
+    if not connect_to_db():
+        return False
     
-    if not PG_CONN or not PG_CURSOR:
-        if not connect_to_db():
-            return False
+    try:
+        with pg_cursor() as cursor:
+            # The planner's row estimate is close enough and costs no scan
+            cursor.execute("SELECT reltuples FROM pg_class WHERE oid = 'page_embeddings'::regclass")
+            rows = max(cursor.fetchone()[0], 0)
+        with merge_lock:
+            bulk_load = {"rows": rows, "merged": 0, "dropped": False}
+        return True
+    except Exception as e:
+        print(f"Error preparing vector DB for bulk load: {e}")
+        return False
+
+# Count merged rows towards the session, dropping the index once they reach the threshold
+def _track_bulk_load(cursor, merged):
+    if bulk_load is None or bulk_load["dropped"]:
+        return
+    
+    bulk_load["merged"] += merged
+    if bulk_load["merged"] >= max(BULK_LOAD_MIN_ROWS, bulk_load["rows"] * BULK_LOAD_DROP_FRACTION):
+        cursor.execute("DROP INDEX IF EXISTS page_embeddings_embedding_bin_hnsw_idx")
+        bulk_load["dropped"] = True
+
+# Rebuild the similarity index once the session's pages are all stored
+def finalize_bulk_load():
+    """Recreate the embedding index after a capture session, if it was dropped"""
+    global bulk_load
+    with merge_lock:
+        session, bulk_load = bulk_load, None
+    if session is None or not session["dropped"]:
+        return True
+    if not connect_to_db():
+        return False
     
     try:
-        # Extract text content
-        if content and isinstance(content, str):
-            if metadata and metadata.get("is_alert", False):
-                # For alerts, use the content directly (it's already simple text)
-                text_content = content
-                content_type = "alert"
-            else:
-                # For regular HTML pages, extract text
-                soup = BeautifulSoup(content, "html.parser")
-                text_content = soup.get_text().strip()
-                content_type = "html"
+        with pg_cursor() as cursor:
+            # Only for this transaction: give the build more memory and workers
+            cursor.execute("SET LOCAL maintenance_work_mem = '1GB'")
+            cursor.execute("SET LOCAL max_parallel_maintenance_workers = 4")
+            create_embedding_index(cursor)
+            return True
+    except Exception as e:
+        print(f"Error rebuilding vector DB index: {e}")
+        return False
+
+# Visible text of an HTML page, using lxml's C parser straight rather than
+# the pure-Python html.parser behind BeautifulSoup
+def extract_text(html):
+    try:
+        document = lxml.html.document_fromstring(html)
+    except (ParserError, ValueError):
+        # Empty documents, or strings that carry an XML encoding declaration
+        return BeautifulSoup(html, "html.parser").get_text().strip()
+    
+    # Script, style and template bodies aren't page text (get_text skipped them too)
+    for element in list(document.iter("script", "style", "template")):
+        element.drop_tree()
+    return document.text_content().strip()
+
+# MinHash signature of a text, as bytes for the bytea column
+def minhash_signature(text):
+    """Signature over 5-word shingles, one min-hash per permutation"""
+    words = text.split()
+    shingles = {" ".join(words[i:i + MINHASH_SHINGLE_WORDS])
+                for i in range(max(1, len(words) - MINHASH_SHINGLE_WORDS + 1))}
+    hashes = np.fromiter((xxhash.xxh3_64_intdigest(shingle.encode("utf-8")) for shingle in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    
+    # Multiply-shift hashing, all permutations at once over a chunk of shingles
+    # (uint64 arithmetic wraps); the running minimum is kept across chunks
+    signature = np.full(MINHASH_PERMUTATIONS, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(hashes), MINHASH_CHUNK_SIZE):
+        chunk = hashes[start:start + MINHASH_CHUNK_SIZE]
+        permuted = (MINHASH_A[:, None] * chunk[None, :] + MINHASH_B[:, None]) >> np.uint64(32)
+        np.minimum(signature, permuted.min(axis=1), out=signature)
+    return signature.astype(np.uint32).tobytes()
+
+# Estimated Jaccard similarity of two MinHash signatures
+def minhash_similarity(signature, other):
+    matches = np.count_nonzero(np.frombuffer(signature, dtype=np.uint32) == np.frombuffer(other, dtype=np.uint32))
+    return matches / MINHASH_PERMUTATIONS
+
+# Cached features for a content digest, or None
+def _cached_features(content_hash):
+    with feature_lock:
+        features = feature_cache.get(content_hash)
+        if features is not None:
+            feature_cache.move_to_end(content_hash)
+        return features
+
+# Remember the features of a page's content
+def _cache_features(content_hash, features):
+    with feature_lock:
+        feature_cache[content_hash] = features
+        feature_cache.move_to_end(content_hash)
+        if len(feature_cache) > FEATURE_CACHE_SIZE:
+            feature_cache.popitem(last=False)
+
+# Turn a captured page into a row that is waiting for its embedding
+def _prepare_row(url, content, metadata=None, session_id=None, content_hash=None):
+    """Extract the text to embed and the columns stored alongside it"""
+    # Digest of the raw content, as bytes for the bytea column; the capture loop
+    # passes the xxh3 digest it already has, anything else is hashed here
+    if content_hash is not None:
+        content_hash = content_hash.to_bytes(8, "big")
+    elif isinstance(content, str):
+        content_hash = xxhash.xxh3_64_digest(content.encode("utf-8", "ignore"))
+    
+    # Extract text content
+    minhash = None
+    if content and isinstance(content, str):
+        if metadata and metadata.get("is_alert", False):
+            # For alerts, use the content directly (it's already simple text)
+            text_content = content
+            content_type = "alert"
         else:
-            text_content = "No content available"
-            content_type = "unknown"
+            # For regular HTML pages, extract text (unless this content was seen recently)
+            features = _cached_features(content_hash)
+            if features is None:
+                text = extract_text(content)
+                features = {"text": text, "minhash": minhash_signature(text), "embedding": None}
+                _cache_features(content_hash, features)
+            text_content = features["text"]
+            minhash = features["minhash"]
+            content_type = "html"
+    else:
+        text_content = "No content available"
+        content_type = "unknown"
+    
+    if minhash is None:
+        minhash = minhash_signature(text_content)
+    
+    # Get title from metadata
+    title = metadata.get("title", "") if metadata else ""
+    is_alert = metadata.get("is_alert", False) if metadata else False
+    
+    # Get current session ID if not provided
+    if not session_id:
+        from database.history_manager import history_manager
+        if history_manager.current_session:
+            session_id = history_manager.current_session.id
+    
+    return (url, text_content, content_type, title, is_alert, session_id, content_hash, minhash)
+
+# Store in Vector DB
+def store_in_pgvector(url, content, metadata=None, session_id=None, content_hash=None):
+    """Queue a page for the vector database; the ingest worker embeds and stores it"""
+    if pool_closed:
+        return False
+    start_ingest_worker()
+    # Blocks only if the worker falls far behind
+    ingest_queue.put((url, content, metadata, session_id, content_hash))
+    return True
+
+# Wait until every queued page has been embedded and stored
+def flush_pending_embeddings():
+    if ingest_thread is not None and ingest_thread.is_alive():
+        ingest_queue.join()
+    merge_staging()
+
+# Background loop that embeds and stores queued pages in batches, until the pool is closed
+def ingest_worker():
+    last_merge = time.monotonic()
+    while not pool_closed:
+        # Staged rows are merged on schedule even when no new pages arrive
+        if time.monotonic() - last_merge >= STAGING_MERGE_INTERVAL:
+            merge_staging()
+            last_merge = time.monotonic()
+        
+        try:
+            items = [ingest_queue.get(timeout=STAGING_MERGE_INTERVAL)]
+        except queue.Empty:
+            continue
+        deadline = time.monotonic() + INGEST_BATCH_WAIT
+        while len(items) < EMBEDDING_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(ingest_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        try:
+            rows = list(prepare_executor.map(lambda item: _prepare_row(*item), items))
+            _write_rows(rows)
+        except Exception as e:
+            print(f"Error ingesting pages into vector DB: {e}")
+        finally:
+            for _ in items:
+                ingest_queue.task_done()
+
+# Start the ingest worker once
+def start_ingest_worker():
+    global ingest_thread
+    with ingest_lock:
+        if ingest_thread is None or not ingest_thread.is_alive():
+            ingest_thread = threading.Thread(target=ingest_worker, daemon=True)
+            ingest_thread.start()
+
+# Move staged rows into page_embeddings, keeping the latest row per page.
+# Rows are deleted and inserted in one statement, so a batch the ingest worker
+# commits meanwhile stays staged for the next merge instead of being lost
+def _merge_staging_rows(cursor):
+    # Also returns the digests the merge may have left unreferenced: those of
+    # every staged row, and those of the rows they overwrite (read before the insert)
+    cursor.execute("""
+    WITH moved AS (
+        DELETE FROM page_embeddings_staging
+        RETURNING url, embedding, content, content_type, timestamp, title, is_alert, session_id, content_hash, minhash, seq
+    ),
+    latest AS (
+        SELECT DISTINCT ON (url)
+            url, embedding, content, content_type, timestamp, title, is_alert, session_id, content_hash, minhash
+        FROM moved
+        ORDER BY url, seq DESC
+    ),
+    merged AS (
+        INSERT INTO page_embeddings
+        (url, embedding, content, content_type, timestamp, title, is_alert, session_id, content_hash, minhash)
+        SELECT url, embedding, content, content_type, timestamp, title, is_alert, session_id, content_hash, minhash
+        FROM latest
+        ON CONFLICT (url) DO UPDATE 
+        SET embedding = EXCLUDED.embedding, 
+            content = EXCLUDED.content, 
+            content_type = EXCLUDED.content_type,
+            timestamp = EXCLUDED.timestamp,
+            title = EXCLUDED.title,
+            is_alert = EXCLUDED.is_alert,
+            session_id = EXCLUDED.session_id,
+            content_hash = EXCLUDED.content_hash,
+            minhash = EXCLUDED.minhash
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM merged), ARRAY(
+        SELECT content_hash FROM moved WHERE content_hash IS NOT NULL
+        UNION
+        SELECT p.content_hash FROM page_embeddings AS p JOIN latest USING (url)
+        WHERE p.content_hash IS NOT NULL
+    )
+    """)
+    merged, replaced = cursor.fetchone()
+    
+    # Text of page versions no longer stored anywhere; without this page_content
+    # would keep every version of every page
+    if replaced:
+        cursor.execute("""
+        DELETE FROM page_content AS c
+        WHERE c.content_hash = ANY(%s::bytea[])
+        AND NOT EXISTS (SELECT 1 FROM page_embeddings AS p WHERE p.content_hash = c.content_hash)
+        AND NOT EXISTS (SELECT 1 FROM page_embeddings_staging AS s WHERE s.content_hash = c.content_hash)
+        """, ([bytes(content_hash) for content_hash in replaced],))
+    return merged
+
+# Merge the staging table into page_embeddings in one transaction
+def merge_staging():
+    """Make staged pages durable and visible to searches"""
+    if not connect_to_db():
+        return False
+    
+    try:
+        with merge_lock, pg_cursor() as cursor:
+            cursor.execute("SET LOCAL synchronous_commit = off")
+            _track_bulk_load(cursor, _merge_staging_rows(cursor))
+            return True
+    except Exception as e:
+        print(f"Error merging staged pages into vector DB: {e}")
+        return False
+
+# Embed a batch of prepared rows in one model call and store the results
+def _write_rows(rows):
+    """Encode the rows as a single batch and write them in one transaction"""
+    if not connect_to_db():
+        return False
+    
+    # A page queued more than once in the batch keeps only its latest
+    # row, since a single statement can't update the same row twice
+    rows = list({row[0]: row for row in rows}.values())
+    
+    try:
+        # Merges collect page_content rows nothing references; holding the lock
+        # keeps one from deleting text this batch relies on before it commits
+        with merge_lock, pg_cursor() as cursor:
+            # The batch commits once without waiting for its WAL flush; a crash can
+            # lose the last moment of captures, which the next visit recaptures
+            cursor.execute("SET LOCAL synchronous_commit = off")
+            timestamp = time.time()
         
-        # Create embedding
-        embedding = model.encode(text_content).astype('float32')
+            # Pages stored with exactly this content, or with near-identical text,
+            # only get their timestamp and session refreshed; the rest go through the model.
+            # A page's latest version may still be waiting in the staging table,
+            # in which case it is the last staged row for that page
+            urls = [row[0] for row in rows]
+            cursor.execute("""
+            SELECT DISTINCT ON (url) url, content_hash, minhash
+            FROM (
+                SELECT url, content_hash, minhash, NULL::bigint AS seq FROM page_embeddings
+                WHERE url = ANY(%s)
+                UNION ALL
+                SELECT url, content_hash, minhash, seq FROM page_embeddings_staging
+                WHERE url = ANY(%s)
+            ) AS stored
+            ORDER BY url, seq DESC NULLS LAST
+            """, (urls, urls))
+            stored = {url: (content_hash and bytes(content_hash), minhash and bytes(minhash))
+                      for url, content_hash, minhash in cursor.fetchall()}
         
-        # Get title from metadata
-        title = metadata.get("title", "") if metadata else ""
-        is_alert = metadata.get("is_alert", False) if metadata else False
+            unchanged = []
+            changed = []
+            for row in rows:
+                stored_hash, stored_minhash = stored.get(row[0], (None, None))
+                if (row[6] is not None and stored_hash == row[6]) or \
+                        (stored_minhash and minhash_similarity(stored_minhash, row[7]) >= NEAR_DUPLICATE_SIMILARITY):
+                    unchanged.append((row[0], timestamp, row[3], row[4], row[5]))
+                else:
+                    changed.append(row)
         
-        # Get current session ID if not provided
-        if not session_id:
-            from database.history_manager import history_manager
-            if history_manager.current_session:
-                session_id = history_manager.current_session.id
+            if unchanged:
+                for table in ("page_embeddings", "page_embeddings_staging"):
+                    execute_values(cursor, f"""
+                        UPDATE {table} AS p
+                        SET timestamp = v.timestamp,
+                            title = v.title,
+                            is_alert = v.is_alert,
+                            session_id = v.session_id
+                        FROM (VALUES %s) AS v (url, timestamp, title, is_alert, session_id)
+                        WHERE p.url = v.url;
+                    """, unchanged, page_size=100)
         
-        # Store URL, embedding and text content for retrieval
-        PG_CURSOR.execute("""
-            INSERT INTO page_embeddings 
-            (url, embedding, content, content_type, timestamp, title, is_alert, session_id) 
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s) 
-            ON CONFLICT (url) DO UPDATE 
-            SET embedding = %s, 
-                content = %s, 
-                content_type = %s,
-                timestamp = %s,
-                title = %s,
-                is_alert = %s,
-                session_id = %s;
-        """, (
-            url, embedding.tolist(), text_content, content_type, time.time(), title, is_alert, session_id,
-            embedding.tolist(), text_content, content_type, time.time(), title, is_alert, session_id
-        ))
+            if changed:
+                # HTML embedded recently keeps its embedding; the rest go through
+                # one forward pass for the whole batch instead of one per page
+                features = [_cached_features(row[6]) if row[2] == "html" else None for row in changed]
+                embeddings = [f["embedding"] if f is not None else None for f in features]
+                misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+                if misses:
+                    encoded = model.encode(
+                        [changed[i][1] for i in misses],
+                        batch_size=EMBEDDING_BATCH_SIZE,
+                        convert_to_numpy=True,
+                        normalize_embeddings=True,
+                        show_progress_bar=False
+                    ).astype('float32')
+                    for i, embedding in zip(misses, encoded):
+                        embeddings[i] = embedding
+                        if features[i] is not None:
+                            features[i]["embedding"] = embedding
+            
+                # Text goes to page_content, compressed and once per digest; only
+                # rows without a digest keep their text inline
+                values = []
+                contents = {}
+                for (url, text_content, content_type, title, is_alert, session_id, content_hash, minhash), embedding in zip(changed, embeddings):
+                    if content_hash is not None:
+                        if content_hash not in contents:
+                            contents[content_hash] = content_compressor.compress(text_content.encode("utf-8"))
+                        text_content = None
+                    values.append((url, embedding, text_content, content_type, timestamp, title, is_alert, session_id, content_hash, minhash))
+                
+                if contents:
+                    execute_values(cursor, """
+                        INSERT INTO page_content (content_hash, content_zst)
+                        VALUES %s
+                        ON CONFLICT (content_hash) DO NOTHING
+                    """, list(contents.items()), page_size=100)
+            
+                # One multi-row insert per batch into the unlogged staging table;
+                # merge_staging moves the rows into page_embeddings
+                execute_values(cursor, """
+                    INSERT INTO page_embeddings_staging 
+                    (url, embedding, content, content_type, timestamp, title, is_alert, session_id, content_hash, minhash) 
+                    VALUES %s 
+                """, values, template="(%s, %s::halfvec, %s, %s, %s, %s, %s, %s, %s, %s)", page_size=100)
         
-        PG_CONN.commit()
-        return True
+            return True
     except Exception as e:
         print(f"Error storing in vector DB: {e}")
-        PG_CONN.rollback()
         return False
 
+# Hot read queries, prepared once per pooled connection so the server doesn't
+# parse and plan them again on every call: name -> (parameter types, statement)
+PREPARED_STATEMENTS = {
+    "page_content": ("text", """
+        SELECT p.content, c.content_zst, p.timestamp, p.content_type, p.title, p.is_alert, p.session_id 
+        FROM page_embeddings AS p
+        LEFT JOIN page_content AS c ON c.content_hash = p.content_hash
+        WHERE p.url = $1
+    """),
+    # Hamming-distance candidates, re-ranked by inner product (= cosine). The
+    # target's embedding is looked up in the same statement, so there is no
+    # extra round-trip to fetch it and send it back
+    "similar_pages": ("text, int, int", """
+        WITH target AS (
+            SELECT embedding, embedding_bin FROM page_embeddings
+            WHERE url = $1
+        )
+        SELECT url, title, -(embedding <#> (SELECT embedding FROM target)) as similarity
+        FROM (
+            SELECT url, title, embedding
+            FROM page_embeddings
+            WHERE url != $1
+            ORDER BY embedding_bin <~> (SELECT embedding_bin FROM target)
+            LIMIT $2
+        ) AS candidates
+        WHERE EXISTS (SELECT 1 FROM target)
+        ORDER BY similarity DESC
+        LIMIT $3
+    """),
+    # Within a session the pages are ranked exactly, found through the session
+    # index; the HNSW scan stops after ef_search rows, before the session filter,
+    # and could leave few or none of the session's pages
+    "similar_pages_in_session": ("text, text, int", """
+        WITH target AS (
+            SELECT embedding FROM page_embeddings
+            WHERE url = $1
+        )
+        SELECT url, title, -(embedding <#> (SELECT embedding FROM target)) as similarity
+        FROM page_embeddings
+        WHERE url != $1 AND session_id = $2 AND EXISTS (SELECT 1 FROM target)
+        ORDER BY similarity DESC
+        LIMIT $3
+    """),
+    # Hamming-distance candidates for the query, re-ranked by inner product
+    "search_pages": ("halfvec, int, int", """
+        SELECT url, title, -(embedding <#> $1) as similarity
+        FROM (
+            SELECT url, title, embedding
+            FROM page_embeddings
+            ORDER BY embedding_bin <~> binary_quantize($1)::bit(384)
+            LIMIT $2
+        ) AS candidates
+        ORDER BY similarity DESC
+        LIMIT $3
+    """),
+    "search_pages_in_session": ("halfvec, text, int", """
+        SELECT url, title, -(embedding <#> $1) as similarity
+        FROM page_embeddings
+        WHERE session_id = $2
+        ORDER BY similarity DESC
+        LIMIT $3
+    """),
+}
+prepared_connections = set()
+
+# Prepare the hot queries on the cursor's connection, once per connection
+def _ensure_prepared(cursor):
+    conn_id = id(cursor.connection)
+    if conn_id in prepared_connections:
+        return
+    
+    # Prepared statements outlive rolled-back transactions, so start clean
+    cursor.execute("DEALLOCATE ALL")
+    for name, (parameter_types, statement) in PREPARED_STATEMENTS.items():
+        cursor.execute(f"PREPARE {name} ({parameter_types}) AS {statement}")
+    prepared_connections.add(conn_id)
+
 # Query page content from Vector DB
 def get_page_content(url):
     """Get the stored text content for a page from Vector DB"""
-    global PG_CONN, PG_CURSOR
-    
-    if not PG_CONN or not PG_CURSOR:
-        if not connect_to_db():
-            return None
+    if not connect_to_db():
+        return None
     
     try:
-        PG_CURSOR.execute("""
-        SELECT content, timestamp, content_type, title, is_alert, session_id 
-        FROM page_embeddings
-        WHERE url = %s
-        """, (url,))
+        with pg_cursor() as cursor:
+            _ensure_prepared(cursor)
+            cursor.execute("EXECUTE page_content (%s)", (url,))
         
-        result = PG_CURSOR.fetchone()
-        if result:
-            content, timestamp, content_type, title, is_alert, session_id = result
+            result = cursor.fetchone()
+            if result:
+                content, content_zst, timestamp, content_type, title, is_alert, session_id = result
+                
+                # Rows stored before page_content existed still carry their text inline
+                if content_zst is not None:
+                    content = zstandard.ZstdDecompressor().decompress(content_zst).decode("utf-8")
             
-            # Format datetime
-            readable_time = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S") if timestamp else "Unknown"
+                # Format datetime
+                readable_time = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S") if timestamp else "Unknown"
             
-            return {
-                "content": content,
-                "timestamp": timestamp,
-                "datetime": readable_time,
-                "content_type": content_type,
-                "title": title,
-                "is_alert": is_alert,
-                "session_id": session_id
-            }
-        return None
+                return {
+                    "content": content,
+                    "timestamp": timestamp,
+                    "datetime": readable_time,
+                    "content_type": content_type,
+                    "title": title,
+                    "is_alert": is_alert,
+                    "session_id": session_id
+                }
+            return None
     except Exception as e:
         print(f"Error retrieving page content: {e}")
         return None
 
+# Result dicts for (url, title, similarity) rows, with the similarity as a
+# percentage; the scaling, rounding and threshold run over the whole column at once
+def _similarity_results(rows, min_similarity=None):
+    if not rows:
+        return []
+    
+    urls, titles, similarities = zip(*rows)
+    similarities = np.asarray(similarities, dtype=np.float64)
+    percentages = np.round(similarities * 100, 2).tolist()  # Convert to percentage
+    if min_similarity is None:
+        keep = [True] * len(rows)
+    else:
+        keep = (similarities > min_similarity).tolist()
+    
+    return [{"url": url, "title": title or url, "similarity": percentage}
+            for url, title, percentage, kept in zip(urls, titles, percentages, keep) if kept]
+
 # Find similar pages
 def find_similar_pages(url, limit=5, session_id=None):
     """Find pages with similar content based on vector embeddings"""
-    global PG_CONN, PG_CURSOR
-    
-    if not PG_CONN or not PG_CURSOR:
-        if not connect_to_db():
-            return []
+    if not connect_to_db():
+        return []
     
     try:
-        # First get the embedding for the target URL
-        PG_CURSOR.execute("""
-        SELECT embedding FROM page_embeddings
-        WHERE url = %s
-        """, (url,))
-        
-        result = PG_CURSOR.fetchone()
-        if not result:
-            return []
-            
-        target_embedding = result[0]
-        
-        # Find similar pages using cosine similarity
-        if session_id:
-            # Filter by session
-            PG_CURSOR.execute("""
-            SELECT url, title, 1 - (embedding <=> %s) as similarity
-            FROM page_embeddings
-            WHERE url != %s AND session_id = %s
-            ORDER BY similarity DESC
-            LIMIT %s
-            """, (target_embedding, url, session_id, limit))
-        else:
-            # All sessions
-            PG_CURSOR.execute("""
-            SELECT url, title, 1 - (embedding <=> %s) as similarity
-            FROM page_embeddings
-            WHERE url != %s
-            ORDER BY similarity DESC
-            LIMIT %s
-            """, (target_embedding, url, limit))
+        with pg_cursor() as cursor:
+            _ensure_prepared(cursor)
+            if session_id:
+                # Filter by session
+                cursor.execute("EXECUTE similar_pages_in_session (%s, %s, %s)",
+                               (url, session_id, limit))
+            else:
+                # All sessions
+                cursor.execute("EXECUTE similar_pages (%s, %s, %s)", (url, CANDIDATE_POOL, limit))
         
-        similar_pages = []
-        for similar_url, title, similarity in PG_CURSOR.fetchall():
-            similar_pages.append({
-                "url": similar_url,
-                "title": title or similar_url,
-                "similarity": round(similarity * 100, 2)  # Convert to percentage
-            })
-            
-        return similar_pages
+            return _similarity_results(cursor.fetchall())
     except Exception as e:
         print(f"Error finding similar pages: {e}")
         return []
@@ -241,46 +814,26 @@ def find_similar_pages(url, limit=5, session_id=None):
 # Search pages by keyword
 def search_pages(query, limit=10, session_id=None):
     """Search pages by keyword in content"""
-    global PG_CONN, PG_CURSOR
-    
-    if not PG_CONN or not PG_CURSOR:
-        if not connect_to_db():
-            return []
+    if not connect_to_db():
+        return []
     
     try:
-        # Create embedding for the query
-        query_embedding = model.encode(query).astype('float32')
+        with pg_cursor() as cursor:
+            # Create embedding for the query
+            query_embedding = model.encode(query, normalize_embeddings=True).astype('float32')
         
-        # Search using vector similarity
-        if session_id:
-            # Filter by session
-            PG_CURSOR.execute("""
-            SELECT url, title, 1 - (embedding <=> %s) as similarity
-            FROM page_embeddings
-            WHERE session_id = %s
-            ORDER BY similarity DESC
-            LIMIT %s
-            """, (query_embedding.tolist(), session_id, limit))
-        else:
-            # All sessions
-            PG_CURSOR.execute("""
-            SELECT url, title, 1 - (embedding <=> %s) as similarity
-            FROM page_embeddings
-            ORDER BY similarity DESC
-            LIMIT %s
-            """, (query_embedding.tolist(), limit))
+            # Search using vector similarity
+            _ensure_prepared(cursor)
+            if session_id:
+                # Filter by session
+                cursor.execute("EXECUTE search_pages_in_session (%s, %s, %s)",
+                               (query_embedding, session_id, limit))
+            else:
+                # All sessions
+                cursor.execute("EXECUTE search_pages (%s, %s, %s)", (query_embedding, CANDIDATE_POOL, limit))
         
-        results = []
-        for url, title, similarity in PG_CURSOR.fetchall():
             # Only include results with reasonable similarity
-            if similarity > 0.5:  # Adjust threshold as needed
-                results.append({
-                    "url": url,
-                    "title": title or url,
-                    "similarity": round(similarity * 100, 2)
-                })
-        
-        return results
+            return _similarity_results(cursor.fetchall(), min_similarity=0.5)  # Adjust threshold as needed
     except Exception as e:
         print(f"Error searching pages: {e}")
         return []
@@ -288,47 +841,45 @@ def search_pages(query, limit=10, session_id=None):
 # Get all pages in the database
 def get_all_pages(limit=100, offset=0, session_id=None):
     """Get all pages in the database, with pagination"""
-    global PG_CONN, PG_CURSOR
-    
-    if not PG_CONN or not PG_CURSOR:
-        if not connect_to_db():
-            return []
+    if not connect_to_db():
+        return []
     
     try:
-        if session_id:
-            # Filter by session
-            PG_CURSOR.execute("""
-            SELECT url, title, content_type, timestamp, is_alert, session_id
-            FROM page_embeddings
-            WHERE session_id = %s
-            ORDER BY timestamp DESC
-            LIMIT %s OFFSET %s
-            """, (session_id, limit, offset))
-        else:
-            # All sessions
-            PG_CURSOR.execute("""
-            SELECT url, title, content_type, timestamp, is_alert, session_id
-            FROM page_embeddings
-            ORDER BY timestamp DESC
-            LIMIT %s OFFSET %s
-            """, (limit, offset))
+        with pg_cursor() as cursor:
+            if session_id:
+                # Filter by session
+                cursor.execute("""
+                SELECT url, title, content_type, timestamp, is_alert, session_id
+                FROM page_embeddings
+                WHERE session_id = %s
+                ORDER BY timestamp DESC
+                LIMIT %s OFFSET %s
+                """, (session_id, limit, offset))
+            else:
+                # All sessions
+                cursor.execute("""
+                SELECT url, title, content_type, timestamp, is_alert, session_id
+                FROM page_embeddings
+                ORDER BY timestamp DESC
+                LIMIT %s OFFSET %s
+                """, (limit, offset))
         
-        pages = []
-        for url, title, content_type, timestamp, is_alert, session_id in PG_CURSOR.fetchall():
-            # Format datetime
-            readable_time = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S") if timestamp else "Unknown"
+            pages = []
+            for url, title, content_type, timestamp, is_alert, session_id in cursor.fetchall():
+                # Format datetime
+                readable_time = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S") if timestamp else "Unknown"
             
-            pages.append({
-                "url": url,
-                "title": title or url,
-                "content_type": content_type,
-                "timestamp": timestamp,
-                "datetime": readable_time,
-                "is_alert": is_alert,
-                "session_id": session_id
-            })
+                pages.append({
+                    "url": url,
+                    "title": title or url,
+                    "content_type": content_type,
+                    "timestamp": timestamp,
+                    "datetime": readable_time,
+                    "is_alert": is_alert,
+                    "session_id": session_id
+                })
         
-        return pages
+            return pages
     except Exception as e:
         print(f"Error getting all pages: {e}")
         return []
@@ -336,81 +887,57 @@ def get_all_pages(limit=100, offset=0, session_id=None):
 # Get database statistics
 def get_db_stats(session_id=None):
     """Get statistics about the vector database"""
-    global PG_CONN, PG_CURSOR
-    
-    if not PG_CONN or not PG_CURSOR:
-        if not connect_to_db():
-            return {}
+    if not connect_to_db():
+        return {}
     
     try:
-        # Get total count
-        if session_id:
-            PG_CURSOR.execute("SELECT COUNT(*) FROM page_embeddings WHERE session_id = %s", (session_id,))
-        else:
-            PG_CURSOR.execute("SELECT COUNT(*) FROM page_embeddings")
-            
-        total_count = PG_CURSOR.fetchone()[0]
-        
-        # Get counts by content type
-        if session_id:
-            PG_CURSOR.execute("""
-            SELECT content_type, COUNT(*) 
-            FROM page_embeddings 
-            WHERE session_id = %s
-            GROUP BY content_type
-            """, (session_id,))
-        else:
-            PG_CURSOR.execute("""
-            SELECT content_type, COUNT(*) 
-            FROM page_embeddings 
-            GROUP BY content_type
-            """)
-            
-        content_types = {row[0]: row[1] for row in PG_CURSOR.fetchall()}
-        
-        # Get alert count
-        if session_id:
-            PG_CURSOR.execute("""
-            SELECT COUNT(*) FROM page_embeddings 
-            WHERE is_alert = true AND session_id = %s
-            """, (session_id,))
-        else:
-            PG_CURSOR.execute("SELECT COUNT(*) FROM page_embeddings WHERE is_alert = true")
-            
-        alert_count = PG_CURSOR.fetchone()[0]
-        
-        # Get earliest and latest timestamps
-        if session_id:
-            PG_CURSOR.execute("""
-            SELECT MIN(timestamp), MAX(timestamp) 
-            FROM page_embeddings
-            WHERE session_id = %s
-            """, (session_id,))
-        else:
-            PG_CURSOR.execute("SELECT MIN(timestamp), MAX(timestamp) FROM page_embeddings")
+        with pg_cursor() as cursor:
+            # Counts, alerts and time range per content type in one scan; the
+            # totals are summed up from the groups
+            if session_id:
+                cursor.execute("""
+                SELECT content_type, COUNT(*), COUNT(*) FILTER (WHERE is_alert), MIN(timestamp), MAX(timestamp)
+                FROM page_embeddings
+                WHERE session_id = %s
+                GROUP BY content_type
+                """, (session_id,))
+            else:
+                cursor.execute("""
+                SELECT content_type, COUNT(*), COUNT(*) FILTER (WHERE is_alert), MIN(timestamp), MAX(timestamp)
+                FROM page_embeddings
+                GROUP BY content_type
+                """)
             
-        min_ts, max_ts = PG_CURSOR.fetchone()
+            groups = cursor.fetchall()
+            content_types = {content_type: count for content_type, count, _, _, _ in groups}
+            total_count = sum(content_types.values())
+            alert_count = sum(alerts for _, _, alerts, _, _ in groups)
+            min_ts = min((group[3] for group in groups if group[3] is not None), default=None)
+            max_ts = max((group[4] for group in groups if group[4] is not None), default=None)
         
-        return {
-            "total": total_count,
-            "content_types": content_types,
-            "alerts": alert_count,
-            "first_capture": datetime.fromtimestamp(min_ts).strftime("%Y-%m-%d %H:%M:%S") if min_ts else None,
-            "latest_capture": datetime.fromtimestamp(max_ts).strftime("%Y-%m-%d %H:%M:%S") if max_ts else None
-        }
+            return {
+                "total": total_count,
+                "content_types": content_types,
+                "alerts": alert_count,
+                "first_capture": datetime.fromtimestamp(min_ts).strftime("%Y-%m-%d %H:%M:%S") if min_ts else None,
+                "latest_capture": datetime.fromtimestamp(max_ts).strftime("%Y-%m-%d %H:%M:%S") if max_ts else None
+            }
     except Exception as e:
         print(f"Error getting DB stats: {e}")
         return {
             "error": str(e)
         }
 
-# Close the PostgreSQL connection when the application exits
+# Close the PostgreSQL connections when the application exits
 def close_pg_connection():
-    global PG_CONN, PG_CURSOR
-    if PG_CURSOR:
-        PG_CURSOR.close()
-    if PG_CONN:
-        PG_CONN.close()
+    global PG_POOL, pool_closed
+    with pool_lock:
+        pool_closed = True
+        if PG_POOL is not None:
+            PG_POOL.closeall()
+            PG_POOL = None
+        # Statements prepared on the closed connections went with them
+        prepared_connections.clear()
 
 # Initialize connection and database when this module is imported
 connect_to_db()
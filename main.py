@@ -6,7 +6,7 @@ from PyQt5.QtWidgets import QApplication
 import atexit
 
 from ui.app_window import WebFlowCaptureApp
-from browser.controller import stop_browser
+from browser.controller import stop_browser, wait_for_capture_flush
 from database.graph_db import close_neo4j_connection
 from database.vector_db import close_pg_connection
 
@@ -21,6 +21,7 @@ def cleanup():
     """Cleanup function to be called on exit"""
     print("Cleaning up resources...")
     stop_browser()
+    wait_for_capture_flush()
     close_neo4j_connection()
     close_pg_connection()
 
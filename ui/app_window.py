@@ -9,7 +9,8 @@ import time
 from datetime import datetime
 
 from browser.controller import (start_browser, stop_browser, is_browser_alive,
-                                start_capturing, stop_capturing_process)
+                                start_capturing, stop_capturing_process,
+                                wait_for_capture_flush)
 from ui.flow_dialog import FlowVisualizationDialog
 from ui.page_dialog import PageDetailsDialog
 from ui.history_dialog import SessionHistoryDialog
@@ -24,6 +25,7 @@ class WebFlowCaptureApp(QMainWindow):
         self.initUI()
         self.connectSignals()
         self.is_capturing = False
+        self.is_stopping = False
 
         # Setup periodic state update
         self.timer = QTimer(self)
@@ -221,6 +223,7 @@ class WebFlowCaptureApp(QMainWindow):
         signals.page_captured.connect(self.on_page_captured)
         signals.alert_captured.connect(self.on_alert_captured)
         signals.new_tab_detected.connect(self.on_new_tab)
+        signals.capture_stopped.connect(self.on_capture_stopped)
 
     def updateState(self):
         """Update UI state based on browser and capture status"""
@@ -233,7 +236,7 @@ class WebFlowCaptureApp(QMainWindow):
 
             # Only enable start capture if we have a URL
             if self.website_entry.text().strip():
-                self.start_capture_button.setEnabled(not self.is_capturing)
+                self.start_capture_button.setEnabled(not self.is_capturing and not self.is_stopping)
             else:
                 self.start_capture_button.setEnabled(False)
         else:
@@ -246,6 +249,9 @@ class WebFlowCaptureApp(QMainWindow):
         if self.is_capturing:
             self.capture_status.setText("Capture: Active")
             self.stop_capture_button.setEnabled(True)
+        elif self.is_stopping:
+            self.capture_status.setText("Capture: Stopping")
+            self.stop_capture_button.setEnabled(False)
         else:
             self.capture_status.setText("Capture: Inactive")
             self.stop_capture_button.setEnabled(False)
@@ -557,7 +563,7 @@ class WebFlowCaptureApp(QMainWindow):
 
     def validate_inputs(self):
         website = self.website_entry.text().strip()
-        if website and is_browser_alive() and not self.is_capturing:
+        if website and is_browser_alive() and not self.is_capturing and not self.is_stopping:
             self.start_capture_button.setEnabled(True)
         else:
             self.start_capture_button.setEnabled(False)
@@ -613,16 +619,29 @@ class WebFlowCaptureApp(QMainWindow):
         self.update_status(f"Started capturing for {target_url}")
 
     def stop_capturing(self):
+        # Stop capturing process; pending writes are flushed in the background
+        # and the session ends in on_capture_stopped
+        self.is_capturing = False
+        self.is_stopping = True
+        self.capture_status.setText("Capture: Stopping")
+        self.stop_capture_button.setEnabled(False)
+        self.start_capture_button.setEnabled(False)
+        self.update_status("Saving captured pages...")
+
+        stop_capturing_process()
+
+    @pyqtSlot()
+    def on_capture_stopped(self):
+        """Called once a stopped capture's pending writes are stored"""
+        if not self.is_stopping:
+            return
+        self.is_stopping = False
+
         # End current session
         if history_manager.end_current_session():
             self.update_status("Session saved to history")
 
-        # Stop capturing process
-        stop_capturing_process()
-
-        self.is_capturing = False
         self.capture_status.setText("Capture: Inactive")
-        self.stop_capture_button.setEnabled(False)
 
         if is_browser_alive():
             self.start_capture_button.setEnabled(True)
@@ -674,12 +693,6 @@ class WebFlowCaptureApp(QMainWindow):
         details_dialog.exec_()
 
     def closeEvent(self, event):
-        # End any active session to ensure it's saved
-        if history_manager.current_session and not history_manager.current_session.end_time:
-            self.update_status("Saving current session before exit...")
-            history_manager.end_current_session()
-            history_manager.save_history()  # Extra save to be sure
-
         # Ensure capturing is stopped first
         if self.is_capturing:
             self.stop_capturing()
@@ -687,6 +700,16 @@ class WebFlowCaptureApp(QMainWindow):
         # Stop browser
         stop_browser()
 
+        # Pending writes go in before the session's stats are taken and the
+        # databases are closed
+        wait_for_capture_flush()
+
+        # End any active session to ensure it's saved
+        if history_manager.current_session and not history_manager.current_session.end_time:
+            self.update_status("Saving current session before exit...")
+            history_manager.end_current_session()
+            history_manager.save_history()  # Extra save to be sure
+
         # Stop timer
         self.timer.stop()
 
@@ -14,6 +14,7 @@ class WorkerSignals(QObject):
     alert_captured = pyqtSignal(str, str)  # URL, message
     new_tab_detected = pyqtSignal(str)    # URL
     browser_state_changed = pyqtSignal(bool)  # isAlive
+    capture_stopped = pyqtSignal()  # Pending writes of a stopped capture are stored
 
 # Global signals instance
 signals = WorkerSignals()
\ No newline at end of file